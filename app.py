@@ -1,21 +1,181 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
-from database import FinanceDB
-from datetime import datetime, date
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, session, flash
+from flask.json.provider import DefaultJSONProvider
+from markupsafe import Markup
+from database import FinanceDB, DEFAULT_CURRENCY, normalize_currency
+from records import Record
+from events import EventBroker
+from fragment_cache import FragmentCache
+from datetime import datetime, date, timedelta
 import calendar
+import hmac
 import json
+import math
 import os
 
+class FinanceJSONProvider(DefaultJSONProvider):
+    """JSON provider that knows how to serialize database records"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Record):
+            return o.asdict()
+        return DefaultJSONProvider.default(o)
+
 # Create Flask app
 app = Flask(__name__)
+app.json = FinanceJSONProvider(app)
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-this-in-production')
 
-# Initialize database
-db = FinanceDB()
+# Initialize database - reports, trends and exports read from a snapshot
+# refreshed in the background every SNAPSHOT_MAX_AGE seconds (when the data changed)
+db = FinanceDB(snapshot_max_age=int(os.environ.get('SNAPSHOT_MAX_AGE', 60)))
+
+# Daily exchange rates file (date,currency,rate), reloaded whenever it changes
+EXCHANGE_RATES_FILE = os.environ.get('EXCHANGE_RATES_FILE', 'instance/exchange_rates.csv')
+EXCHANGE_RATES_REFERENCE = os.environ.get('EXCHANGE_RATES_REFERENCE', 'USD')
+
+# Live dashboard updates (server-sent events). Each open stream holds a
+# worker thread, so at most MAX_EVENT_STREAMS are open per process (keep it
+# below gunicorn's --threads) and each ends after EVENT_STREAM_SECONDS
+broker = EventBroker(max_streams=int(os.environ.get('MAX_EVENT_STREAMS', 6)),
+                     stream_seconds=int(os.environ.get('EVENT_STREAM_SECONDS', 60)))
+
+# Rendered dashboard/report fragments, keyed by user and data version
+fragments = FragmentCache(max_entries=int(os.environ.get('FRAGMENT_CACHE_SIZE', 500)))
+
+# Token operators send (X-Stats-Token header) to read /api/cache_stats;
+# the route is disabled when this is not set
+STATS_TOKEN = os.environ.get('STATS_TOKEN')
+
+@app.before_request
+def refresh_exchange_rates():
+    """Load the exchange-rates file if it is new or has changed"""
+    if not os.path.exists(EXCHANGE_RATES_FILE):
+        return
+    
+    # Changed rates bump every user's data version, which invalidates
+    # their cached fragments
+    try:
+        db.load_exchange_rates(EXCHANGE_RATES_FILE, EXCHANGE_RATES_REFERENCE)
+    except (OSError, KeyError, ValueError) as e:
+        # Keep serving with the rates already in the database
+        print(f"❌ Error loading exchange rates: {e}")
+
+@app.template_filter('money')
+def format_money(amount, currency=DEFAULT_CURRENCY):
+    """Format an amount for display: $12.50 in US dollars, 12.50 EUR otherwise"""
+    if currency == 'USD':
+        return f"${amount:.2f}"
+    return f"{amount:.2f} {currency}"
 
 # Helper function to check if user is logged in
 def is_logged_in():
     return 'user_id' in session
 
+# Helper function to parse YYYY-MM-DD query parameters
+def parse_date(value):
+    if not value:
+        return None
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+# Helper function to parse a CSV amount such as "$1,234.50"
+def parse_amount(value):
+    amount = float(value.replace('$', '').replace(',', ''))
+    if not math.isfinite(amount):
+        raise ValueError(f"invalid amount: {value!r}")
+    return amount
+
+# Helper function to get the first and last day of the current month
+def current_month_range():
+    today = datetime.now()
+    last_day = calendar.monthrange(today.year, today.month)[1]
+    return f"{today.year}-{today.month:02d}-01", f"{today.year}-{today.month:02d}-{last_day:02d}"
+
+# Helper function to render a template fragment through the cache
+def cached_fragment(name, user_id, data_version, period, load_context):
+    """Render templates/fragments/<name>.html, reusing the cached copy while
+    the user's data is unchanged. load_context() only runs on a cache miss."""
+    return fragments.get_or_render(
+        (name, user_id, data_version, period),
+        lambda: Markup(render_template(f'fragments/{name}.html', **load_context()))
+    )
+
+# Helper function to build the last 6 months of income/expense summaries
+def get_recent_monthly_data(user_id, current_date):
+    monthly_data = []
+    for i in range(6):
+        month = current_date.month - i
+        year = current_date.year
+        
+        if month <= 0:
+            month += 12
+            year -= 1
+        
+        summary = db.get_monthly_summary(user_id, year, month, use_snapshot=True)
+        monthly_data.append({
+            'month': calendar.month_name[month],
+            'year': year,
+            'summary': summary
+        })
+    
+    monthly_data.reverse()  # Oldest to newest
+    return monthly_data
+
+# Helper function to get this month's totals for a live update
+def get_live_summary(user_id):
+    """Current month totals, tagged with the currency they are in"""
+    today = datetime.now()
+    summary = db.get_monthly_summary(user_id, today.year, today.month)
+    summary['currency'] = db.get_base_currency(user_id)
+    return summary
+
+# Helper function to build the full live-dashboard state as SSE events
+def get_dashboard_state(user_id):
+    """(event, data) pairs for the month totals, every spending slice and the
+    recent transactions list"""
+    spending = db.get_spending_by_category(user_id, *current_month_range())
+    recent = db.get_transactions(user_id, limit=10)
+    return [
+        ('summary', get_live_summary(user_id)),
+        ('categories', [category.asdict() for category in spending]),
+        ('recent_transactions', [transaction.asdict() for transaction in recent])
+    ]
+
+# Helper function to build the live updates for one added transaction
+def get_transaction_update(user_id, transaction_id):
+    """(event, data) pairs for one new transaction: the month totals, the
+    transaction itself and its spending slice"""
+    transaction = db.get_transaction(user_id, transaction_id)
+    updates = [('summary', get_live_summary(user_id)), ('transaction', transaction.asdict())]
+    if transaction.transaction_type == 'expense':
+        spending = db.get_spending_by_category(user_id, *current_month_range())
+        category = next((c for c in spending if c.name == transaction.category_name), None)
+        updates.append(('category', {
+            'name': transaction.category_name,
+            'color': transaction.category_color,
+            'total_amount': category.total_amount if category else 0
+        }))
+    return updates
+
+# Helper function to push dashboard changes to the user's open pages
+def publish_dashboard_update(user_id, updates=None, data_version=None):
+    """Publish (event, data) updates after a write - by default the whole
+    dashboard state, since batch changes can touch any category or row
+    
+    Events are tagged with the user's data version (read before the updates
+    were built), which is also the SSE event id: a stream that reconnects
+    with the current version has missed nothing. Streams on other worker
+    processes catch up that way too.
+    """
+    if not broker.has_subscribers(user_id):
+        return
+    
+    if updates is None:
+        data_version = db.get_data_version(user_id)
+        updates = get_dashboard_state(user_id)
+    for event, data in updates:
+        broker.publish(user_id, event, data, event_id=data_version)
+
 # Helper function to get current user info
 def get_current_user():
     if is_logged_in():
@@ -98,22 +258,32 @@ def dashboard():
     current_month = current_date.month
     current_year = current_date.year
     
-    # Get monthly summary
-    monthly_summary = db.get_monthly_summary(user['id'], current_year, current_month)
+    data_version = db.get_data_version(user['id'])
+    period = (current_year, current_month)
     
-    # Get recent transactions (last 10)
-    recent_transactions = db.get_transactions(user['id'], limit=10)
+    # Monthly summary cards
+    summary_cards = cached_fragment('summary_cards', user['id'], data_version, period, lambda: {
+        'monthly_summary': db.get_monthly_summary(user['id'], current_year, current_month),
+        'base_currency': db.get_base_currency(user['id'])
+    })
     
-    # Get spending by category for current month
-    start_date = f"{current_year}-{current_month:02d}-01"
-    end_date = f"{current_year}-{current_month:02d}-{calendar.monthrange(current_year, current_month)[1]:02d}"
-    spending_by_category = db.get_spending_by_category(user['id'], start_date, end_date)
+    # Recent transactions (last 10)
+    recent_transactions = cached_fragment('recent_transactions', user['id'], data_version, None, lambda: {
+        'recent_transactions': db.get_transactions(user['id'], limit=10)
+    })
+    
+    # Spending by category for current month
+    spending_breakdown = cached_fragment('spending_breakdown', user['id'], data_version, period, lambda: {
+        'spending_by_category': db.get_spending_by_category(user['id'], *current_month_range()),
+        'base_currency': db.get_base_currency(user['id'])
+    })
     
     return render_template('dashboard.html', 
                          user=user,
-                         monthly_summary=monthly_summary,
+                         summary_cards=summary_cards,
                          recent_transactions=recent_transactions,
-                         spending_by_category=spending_by_category,
+                         spending_breakdown=spending_breakdown,
+                         data_version=data_version,
                          current_month=calendar.month_name[current_month],
                          current_year=current_year)
 
@@ -130,7 +300,8 @@ def transactions():
     return render_template('transactions.html', 
                          user=user,
                          transactions=all_transactions,
-                         categories=categories)
+                         categories=categories,
+                         base_currency=db.get_base_currency(user['id']))
 
 @app.route('/add_transaction', methods=['POST'])
 def add_transaction():
@@ -149,21 +320,151 @@ def add_transaction():
                 return jsonify({'success': False, 'message': f'{field} is required'}), 400
         
         # Add transaction to database
-        db.add_transaction(
+        transaction_id = db.add_transaction(
             user_id=user['id'],
             category_id=int(data['category_id']),
             amount=float(data['amount']),
             description=data['description'],
             transaction_type=data['transaction_type'],
-            date=data['date']
+            date=data['date'],
+            allow_duplicate=bool(data.get('allow_duplicate')),
+            currency=data.get('currency') or None
         )
         
-        return jsonify({'success': True, 'message': 'Transaction added successfully!'})
+        if transaction_id is None:
+            return jsonify({'success': False, 'duplicate': True,
+                            'message': 'This transaction looks like a duplicate of an existing one'}), 409
         
+        # Also returned to the submitting page, which may have no live stream
+        # (stream limit reached, or it is connected to another worker)
+        data_version = db.get_data_version(user['id'])
+        updates = get_transaction_update(user['id'], transaction_id)
+        publish_dashboard_update(user['id'], updates, data_version)
+        return jsonify({'success': True, 'updates': updates, 'message': 'Transaction added successfully!'})
+        
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         print(f"Error adding transaction: {e}")
         return jsonify({'success': False, 'message': 'Error adding transaction'}), 500
 
+def batch_selector(data):
+    """Pull the ids / description filter for a batch operation out of a request"""
+    return {
+        'ids': data.get('ids'),
+        'description_contains': data.get('description_contains')
+    }
+
+@app.route('/update_transactions', methods=['POST'])
+def update_transactions():
+    """Edit fields on a batch of transactions"""
+    if not is_logged_in():
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    
+    data = request.get_json() or {}
+    user = get_current_user()
+    
+    try:
+        updated = db.update_transactions(user['id'], data.get('changes') or {}, **batch_selector(data))
+    except (ValueError, TypeError) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    publish_dashboard_update(user['id'])
+    return jsonify({'success': True, 'updated': updated,
+                    'message': f'{updated} transaction(s) updated'})
+
+@app.route('/recategorize_transactions', methods=['POST'])
+def recategorize_transactions():
+    """Move a batch of transactions to another category"""
+    if not is_logged_in():
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    
+    data = request.get_json() or {}
+    user = get_current_user()
+    
+    if not data.get('category_id'):
+        return jsonify({'success': False, 'message': 'category_id is required'}), 400
+    
+    try:
+        updated = db.recategorize_transactions(user['id'], int(data['category_id']), **batch_selector(data))
+    except (ValueError, TypeError) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    publish_dashboard_update(user['id'])
+    return jsonify({'success': True, 'updated': updated,
+                    'message': f'{updated} transaction(s) moved'})
+
+@app.route('/delete_transactions', methods=['POST'])
+def delete_transactions():
+    """Delete a batch of transactions"""
+    if not is_logged_in():
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    
+    data = request.get_json() or {}
+    user = get_current_user()
+    
+    try:
+        deleted = db.delete_transactions(user['id'], **batch_selector(data))
+    except (ValueError, TypeError) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    publish_dashboard_update(user['id'])
+    return jsonify({'success': True, 'deleted': deleted,
+                    'message': f'{deleted} transaction(s) deleted'})
+
+@app.route('/events')
+def events():
+    """Server-sent event stream of the user's dashboard updates"""
+    if not is_logged_in():
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    user = get_current_user()
+    subscriber = broker.subscribe(user['id'])
+    if subscriber is None:
+        return jsonify({'error': 'Too many live update streams open'}), 503
+    
+    # The client's last event id is the data version its page reflects (the
+    # browser sends Last-Event-ID on reconnect; the first connect passes the
+    # version the page was rendered at). Only if something changed since is
+    # the current state sent, so an idle reconnect costs one small query.
+    seen_version = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    data_version = db.get_data_version(user['id'])
+    initial = get_dashboard_state(user['id']) if seen_version != str(data_version) else ()
+    stream = broker.stream(user['id'], subscriber, initial=initial, initial_id=data_version)
+    response = Response(stream, mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # A stream that is never iterated (client gone before the first byte)
+    # still has to give its slot back
+    response.call_on_close(lambda: broker.unsubscribe(user['id'], subscriber))
+    return response
+
+@app.route('/api/cache_stats')
+def api_cache_stats():
+    """Operator endpoint for this worker's fragment cache size and hit rate"""
+    token = request.headers.get('X-Stats-Token', '')
+    if not STATS_TOKEN or not hmac.compare_digest(token.encode(), STATS_TOKEN.encode()):
+        return jsonify({'error': 'Not found'}), 404
+    
+    return jsonify(dict(fragments.stats(), pid=os.getpid()))
+
+@app.route('/set_base_currency', methods=['POST'])
+def set_base_currency():
+    """Change the currency totals are reported in"""
+    if not is_logged_in():
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    
+    data = request.get_json() or {}
+    user = get_current_user()
+    
+    try:
+        currency = db.set_base_currency(user['id'], data.get('currency'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    publish_dashboard_update(user['id'])
+    return jsonify({'success': True, 'currency': currency,
+                    'message': f'Totals are now shown in {currency}'})
+
 @app.route('/api/categories')
 def get_categories():
     """API endpoint to get user's categories"""
@@ -197,6 +498,30 @@ def api_monthly_summary(year, month):
     summary = db.get_monthly_summary(user['id'], year, month)
     return jsonify(summary)
 
+@app.route('/api/category_series')
+def api_category_series():
+    """API endpoint for one category's income or spending over time (drill-down charts)"""
+    if not is_logged_in():
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    user = get_current_user()
+    category_id = request.args.get('category_id', type=int)
+    granularity = request.args.get('granularity', 'month')
+    transaction_type = request.args.get('type', 'expense')
+    
+    if category_id is None:
+        return jsonify({'error': 'category_id is required'}), 400
+    
+    try:
+        end_date = parse_date(request.args.get('end')) or date.today()
+        start_date = parse_date(request.args.get('start')) or end_date - timedelta(days=365)
+        series = db.get_category_series(user['id'], category_id, granularity, start_date, end_date,
+                                        transaction_type=transaction_type, use_snapshot=True)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify(series)
+
 @app.route('/reports')
 def reports():
     """Reports and analytics page"""
@@ -205,29 +530,23 @@ def reports():
     
     user = get_current_user()
     current_date = datetime.now()
+    # Version as of the snapshot, so the cached table matches the data it was
+    # built from (rate reloads bump it too, so converted totals stay right)
+    data_version = db.get_data_version(user['id'], use_snapshot=True)
+    period = (current_date.year, current_date.month)
     
-    # Get last 6 months of data for trends
-    monthly_data = []
-    for i in range(6):
-        month = current_date.month - i
-        year = current_date.year
-        
-        if month <= 0:
-            month += 12
-            year -= 1
-        
-        summary = db.get_monthly_summary(user['id'], year, month)
-        monthly_data.append({
-            'month': calendar.month_name[month],
-            'year': year,
-            'summary': summary
-        })
-    
-    monthly_data.reverse()  # Oldest to newest
+    # Last 6 months of data for trends (statistics table + chart data)
+    monthly_statistics = cached_fragment(
+        'monthly_statistics', user['id'], data_version, period,
+        lambda: {'monthly_data': get_recent_monthly_data(user['id'], current_date),
+                 'base_currency': db.get_base_currency(user['id'], use_snapshot=True)}
+    )
+    categories = db.get_categories(user['id'])
     
     return render_template('reports.html', 
                          user=user,
-                         monthly_data=monthly_data)
+                         monthly_statistics=monthly_statistics,
+                         categories=categories)
 
 @app.route('/export_csv')
 def export_csv():
@@ -240,14 +559,14 @@ def export_csv():
     import io
     
     user = get_current_user()
-    transactions = db.get_transactions(user['id'])
+    transactions = db.get_transactions(user['id'], use_snapshot=True)
     
     # Create CSV in memory
     output = io.StringIO()
     writer = csv.writer(output)
     
     # Write header
-    writer.writerow(['Date', 'Category', 'Description', 'Type', 'Amount'])
+    writer.writerow(['Date', 'Category', 'Description', 'Type', 'Amount', 'Currency'])
     
     # Write transactions
     for transaction in transactions:
@@ -256,7 +575,8 @@ def export_csv():
             transaction['category_name'],
             transaction['description'],
             transaction['transaction_type'].title(),
-            f"${transaction['amount']:.2f}"
+            f"{transaction['amount']:.2f}",
+            transaction['currency']
         ])
     
     # Create response
@@ -266,6 +586,59 @@ def export_csv():
     
     return response
 
+@app.route('/import_csv', methods=['POST'])
+def import_csv():
+    """Import transactions from a CSV file in the same format as /export_csv"""
+    if not is_logged_in():
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    
+    import csv
+    import io
+    
+    user = get_current_user()
+    upload = request.files.get('file')
+    if not upload:
+        return jsonify({'success': False, 'message': 'file is required'}), 400
+    
+    categories = {c.name.lower(): c.id for c in db.get_categories(user['id'])}
+    fallback_category = categories.get('other')
+    
+    window_days = request.form.get('window_days', type=int)
+    if window_days is not None and window_days < 0:
+        return jsonify({'success': False, 'message': 'window_days must not be negative'}), 400
+    
+    rows = []
+    line = 1
+    try:
+        reader = csv.DictReader(io.StringIO(upload.read().decode('utf-8-sig')))
+        # Data starts on line 2, after the header
+        for line, row in enumerate(reader, start=2):
+            transaction_type = row['Type'].strip().lower()
+            if transaction_type not in ('income', 'expense'):
+                raise ValueError(f"type must be Income or Expense, not {row['Type']!r}")
+            
+            category_id = categories.get(row['Category'].strip().lower(), fallback_category)
+            if category_id is None:
+                raise ValueError(f"unknown category {row['Category']!r} and no 'Other' category to use instead")
+            
+            rows.append({
+                'date': parse_date(row['Date']).isoformat(),
+                'category_id': category_id,
+                'description': row['Description'],
+                'transaction_type': transaction_type,
+                'amount': parse_amount(row['Amount']),
+                'currency': normalize_currency(row['Currency']) if row.get('Currency') else None
+            })
+    except (KeyError, ValueError, AttributeError, UnicodeDecodeError) as e:
+        return jsonify({'success': False, 'message': f'Invalid CSV file (line {line}): {e}'}), 400
+    
+    result = db.import_transactions(user['id'], rows, window_days=window_days)
+    if result['imported']:
+        publish_dashboard_update(user['id'])
+    
+    return jsonify({'success': True, **result,
+                    'message': f"Imported {result['imported']} transaction(s), skipped {result['duplicates']} duplicate(s)"})
+
 # Error handlers
 @app.errorhandler(404)
 def not_found(error):
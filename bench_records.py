@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Benchmark: FinanceDB record types vs sqlite3.Row -> dict conversion
+
+Usage: python bench_records.py [number_of_transactions]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from database import FinanceDB, TRANSACTION_SELECT
+
+# Same columns as FinanceDB.get_transactions
+QUERY = TRANSACTION_SELECT + '''
+    WHERE t.user_id = ?
+    ORDER BY t.date DESC
+'''
+
+
+def seed(db, user_id, count):
+    """Insert `count` fake transactions for the user"""
+    category_id = db.get_categories(user_id)[0]['id']
+    db.import_transactions(user_id, ({
+        'category_id': category_id,
+        'amount': 12.5 + i % 100,
+        'description': f'Purchase #{i}',
+        'transaction_type': 'expense',
+        'date': f'2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}'
+    } for i in range(count)))
+
+
+def read_as_dicts(db, user_id):
+    """The old approach: sqlite3.Row per row, then dict(row)"""
+    conn = db.get_connection()
+    rows = conn.execute(QUERY, (user_id,)).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
+def measure(label, func):
+    """Print wall time and peak memory of one call"""
+    func()  # warm up the page cache
+
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{label:<22} {elapsed * 1000:8.1f} ms   peak {peak / 1024 / 1024:7.2f} MB   ({len(result)} rows)")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = FinanceDB(os.path.join(tmp, 'bench.db'))
+        user_id = db.create_user('bench', 'bench@example.com', 'password123')
+        seed(db, user_id, count)
+
+        print(f"📊 Reading {count} transactions")
+        measure('sqlite3.Row + dict', lambda: read_as_dicts(db, user_id))
+        measure('Transaction records', lambda: db.get_transactions(user_id))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,239 @@
 import sqlite3
 import hashlib
-from datetime import datetime
+from datetime import datetime, date, timedelta
 import os
+import re
+import csv
+import json
+import math
+import time
+import tempfile
+import threading
+from urllib.request import pathname2url
+from records import Transaction, Category, CategorySpending, SeriesPoint
+
+# SQL expression for the start of each time bucket, keyed by granularity
+SERIES_BUCKETS = {
+    'day': "t.date",
+    'week': "date(t.date, '-6 days', 'weekday 1')",  # Monday of that week
+    'month': "strftime('%Y-%m-01', t.date)",
+}
+
+# Currency used when none is given
+DEFAULT_CURRENCY = 'USD'
+
+# SQL expression converting t.amount into the user's (u.base_currency)
+# currency, using the latest rate on or before the transaction date. It is
+# NULL when there is no rate, so SUM() leaves such amounts out rather than
+# counting them at face value; get_monthly_summary reports how many there are.
+CONVERTED_AMOUNT = '''
+    CASE WHEN t.currency = u.base_currency THEN t.amount
+    ELSE t.amount
+        * (SELECT r.rate FROM exchange_rates r WHERE r.currency = t.currency AND r.rate_date <= t.date
+           ORDER BY r.rate_date DESC LIMIT 1)
+        / (SELECT r.rate FROM exchange_rates r WHERE r.currency = u.base_currency AND r.rate_date <= t.date
+           ORDER BY r.rate_date DESC LIMIT 1)
+    END
+'''
+
+
+def normalize_currency(currency):
+    """Validate and upper-case a 3-letter ISO currency code"""
+    code = (currency or '').strip().upper()
+    if not re.fullmatch(r'[A-Z]{3}', code):
+        raise ValueError(f"invalid currency code: {currency!r}")
+    return code
+
+# Columns read into records.Transaction (order must match its __slots__)
+TRANSACTION_SELECT = f'''
+    SELECT t.id, t.user_id, t.category_id, t.amount, t.description,
+           t.transaction_type, t.date, t.currency, t.created_at,
+           c.name as category_name, c.color as category_color,
+           {CONVERTED_AMOUNT} as base_amount
+    FROM transactions t
+    JOIN categories c ON t.category_id = c.id
+    JOIN users u ON u.id = t.user_id
+'''
+
+# Transaction columns that batch updates are allowed to change
+EDITABLE_TRANSACTION_FIELDS = ('category_id', 'amount', 'description', 'transaction_type', 'date', 'currency')
+
+# Default +/- day window used when looking for duplicate transactions
+DEFAULT_DUPLICATE_WINDOW_DAYS = 0
+
+
+def normalize_description(description):
+    """Lowercase a description and strip punctuation / repeated whitespace"""
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', (description or '').lower()).split())
+
+
+# Bumped whenever transaction_fingerprint changes, so init_database knows to
+# recompute stored fingerprints (tracked in PRAGMA user_version)
+FINGERPRINT_VERSION = 2
+
+
+def transaction_fingerprint(amount, description, transaction_type, currency):
+    """Fingerprint used for duplicate detection
+    
+    The date is deliberately left out - it is stored next to the fingerprint
+    in idx_transactions_fingerprint so a +/- N day window is a range scan.
+    """
+    key = f"{round(float(amount) * 100)}|{currency}|{transaction_type}|{normalize_description(description)}"
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+# Upper bound on the number of points a single series may contain
+MAX_SERIES_POINTS = 3660
 
 class FinanceDB:
-    def __init__(self, db_path='instance/finance.db'):
-        """Initialize the database connection"""
+    def __init__(self, db_path='instance/finance.db', duplicate_window_days=DEFAULT_DUPLICATE_WINDOW_DAYS,
+                 snapshot_max_age=None):
+        """Initialize the database connection
+        
+        snapshot_max_age (seconds) enables the read-only analytics snapshot:
+        reads made with use_snapshot=True go to a copy of the database that
+        a background thread refreshes once it is older than this, so no
+        request ever waits for the copy. If the snapshot falls more than
+        twice this far behind, reads go to the live database instead.
+        None always reads the live database.
+        """
         self.db_path = db_path
+        self.duplicate_window_days = duplicate_window_days
+        self.snapshot_max_age = snapshot_max_age
+        self.snapshot_path = os.path.splitext(db_path)[0] + '.snapshot.db'
+        self._snapshot_stop = threading.Event()
+        self._snapshot_refresher_pid = None  # process the refresh thread runs in
+        self._rates_source = None  # (path, mtime) of the last loaded rates file
         # Create the instance directory if it doesn't exist
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
         self.init_database()
+        
+        if snapshot_max_age is not None:
+            self.refresh_snapshot()
+            self._start_snapshot_refresher()
     
-    def get_connection(self):
-        """Get database connection"""
+    def get_connection(self, use_snapshot=False):
+        """Get database connection
+        
+        With use_snapshot=True (and the snapshot enabled) this is a read-only
+        connection to the analytics snapshot, so heavy report queries never
+        hold locks on the database that writes go to.
+        """
+        if use_snapshot and self.snapshot_max_age is not None:
+            if self._snapshot_refresher_pid != os.getpid():
+                # Threads don't survive a fork (e.g. gunicorn --preload)
+                self._start_snapshot_refresher()
+            
+            # Much older than the max age means refreshes are failing - read
+            # live data rather than serve arbitrarily old reports
+            age = self._snapshot_age()
+            if age is not None and age <= 2 * self.snapshot_max_age:
+                return self._snapshot_connection()
+        
         conn = sqlite3.connect(self.db_path)
         conn.row_factory = sqlite3.Row  # This lets us access columns by name
+        conn.create_function('txn_fingerprint', 4, transaction_fingerprint, deterministic=True)
         return conn
     
+    def _snapshot_connection(self):
+        """Read-only connection to the snapshot file"""
+        # The snapshot file is never modified in place (refreshes replace
+        # it), so SQLite can skip locking entirely
+        uri = f'file:{pathname2url(os.path.abspath(self.snapshot_path))}?mode=ro&immutable=1'
+        conn = sqlite3.connect(uri, uri=True)
+        conn.row_factory = sqlite3.Row
+        return conn
+    
+    @staticmethod
+    def _content_version(conn):
+        """Changes whenever any user's data changes (every write bumps a
+        data_version, and so does a change in exchange rates)"""
+        return tuple(conn.execute('SELECT COUNT(*), TOTAL(data_version) FROM users').fetchone())
+    
+    def _snapshot_age(self):
+        """Seconds since the snapshot was last refreshed or confirmed current"""
+        try:
+            return time.time() - os.path.getmtime(self.snapshot_path)
+        except OSError:
+            return None
+    
+    def refresh_snapshot(self):
+        """Copy the live database to the snapshot using SQLite's online backup API
+        
+        The copy is skipped if nothing changed since the last one; the
+        snapshot's mtime is still updated to record that it is current.
+        Returns True if a new copy was made.
+        """
+        source = self.get_connection()
+        try:
+            if os.path.exists(self.snapshot_path):
+                snapshot = self._snapshot_connection()
+                try:
+                    unchanged = self._content_version(snapshot) == self._content_version(source)
+                finally:
+                    snapshot.close()
+                if unchanged:
+                    os.utime(self.snapshot_path)
+                    return False
+            self._copy_to_snapshot(source)
+            return True
+        finally:
+            source.close()
+    
+    def _copy_to_snapshot(self, source):
+        """Back up source into a temporary file and swap it in as the snapshot"""
+        snapshot_dir = os.path.dirname(os.path.abspath(self.snapshot_path))
+        fd, tmp_path = tempfile.mkstemp(dir=snapshot_dir, suffix='.tmp')
+        os.close(fd)
+        
+        try:
+            target = sqlite3.connect(tmp_path)
+            try:
+                source.backup(target)
+                target.execute('PRAGMA journal_mode=DELETE')  # readable without -wal/-shm files
+            finally:
+                target.close()
+            # Atomic swap - open snapshot connections keep reading the old file
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    
+    def _start_snapshot_refresher(self):
+        self._snapshot_refresher_pid = os.getpid()
+        threading.Thread(target=self._refresh_snapshot_loop, name='snapshot-refresher', daemon=True).start()
+    
+    def _refresh_snapshot_loop(self):
+        """Background thread: refresh the snapshot whenever it reaches snapshot_max_age"""
+        while True:
+            age = self._snapshot_age()
+            if age is None:
+                age = self.snapshot_max_age  # missing - refresh right away
+            # Sleep at least a second so a tiny max age can't spin
+            if self._snapshot_stop.wait(max(self.snapshot_max_age - age, 1)):
+                return
+            try:
+                self.refresh_snapshot()
+            except (sqlite3.Error, OSError) as e:
+                # Reports keep reading the previous snapshot; try again next round
+                print(f"❌ Error refreshing snapshot: {e}")
+                if self._snapshot_stop.wait(self.snapshot_max_age):
+                    return
+    
+    def stop_snapshot_refresher(self):
+        """Stop the background snapshot refresh thread"""
+        self._snapshot_stop.set()
+    
     def init_database(self):
         """Create all tables if they don't exist"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        # WAL lets the snapshot backups run alongside writes (the setting
+        # is stored in the database file, so it stays on once enabled)
+        if self.snapshot_max_age is not None:
+            cursor.execute('PRAGMA journal_mode=WAL')
+        
         # Users table - stores user account information
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -75,6 +287,51 @@ class FinanceDB:
             )
         ''')
         
+        # Per-user data version, bumped on every write (used as a render cache key)
+        user_columns = [row['name'] for row in cursor.execute('PRAGMA table_info(users)')]
+        if 'data_version' not in user_columns:
+            cursor.execute('ALTER TABLE users ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0')
+        
+        # Currency the user's totals are reported in
+        if 'base_currency' not in user_columns:
+            cursor.execute(f"ALTER TABLE users ADD COLUMN base_currency TEXT NOT NULL DEFAULT '{DEFAULT_CURRENCY}'")
+        
+        # Exchange rates - value of one unit of currency in the rates file's
+        # reference currency, one row per currency per day
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS exchange_rates (
+                currency TEXT NOT NULL,
+                rate_date DATE NOT NULL,
+                rate REAL NOT NULL,
+                PRIMARY KEY (currency, rate_date)
+            )
+        ''')
+        
+        # Fingerprint and currency columns (added to older databases)
+        columns = [row['name'] for row in cursor.execute('PRAGMA table_info(transactions)')]
+        if 'fingerprint' not in columns:
+            cursor.execute('ALTER TABLE transactions ADD COLUMN fingerprint TEXT')
+        if 'currency' not in columns:
+            cursor.execute(f"ALTER TABLE transactions ADD COLUMN currency TEXT NOT NULL DEFAULT '{DEFAULT_CURRENCY}'")
+        # Fill in missing fingerprints, or recompute them all if they were
+        # made by an older version of transaction_fingerprint
+        fingerprints_current = cursor.execute('PRAGMA user_version').fetchone()[0] >= FINGERPRINT_VERSION
+        cursor.execute(f'''
+            UPDATE transactions SET fingerprint = txn_fingerprint(amount, description, transaction_type, currency)
+            {'WHERE fingerprint IS NULL' if fingerprints_current else ''}
+        ''')
+        cursor.execute(f'PRAGMA user_version = {FINGERPRINT_VERSION}')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_transactions_fingerprint
+            ON transactions (user_id, fingerprint, date)
+        ''')
+        
+        # Index for per-category lookups over a date range (drill-down series)
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_transactions_user_category_date
+            ON transactions (user_id, category_id, date)
+        ''')
+        
         conn.commit()
         conn.close()
         print("✅ Database tables created successfully!")
@@ -145,29 +402,311 @@ class FinanceDB:
             return dict(user)  # Convert to dictionary
         return None
     
-    def add_transaction(self, user_id, category_id, amount, description, transaction_type, date):
-        """Add a new transaction"""
+    def add_transaction(self, user_id, category_id, amount, description, transaction_type, date,
+                        allow_duplicate=False, window_days=None, currency=None):
+        """Add a new transaction
+        
+        currency defaults to the user's base currency. Returns the new
+        transaction id, or None if a matching transaction already exists
+        within +/- window_days (unless allow_duplicate is set).
+        """
+        currency = self.get_base_currency(user_id) if currency is None else normalize_currency(currency)
+        fingerprint = transaction_fingerprint(amount, description, transaction_type, currency)
+        days = self._window_days(window_days)
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            INSERT INTO transactions (user_id, category_id, amount, description, transaction_type, date)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user_id, category_id, amount, description, transaction_type, date))
+        try:
+            # Take the write lock before the duplicate check, so two identical
+            # submits can't both pass the check and both insert
+            cursor.execute('BEGIN IMMEDIATE')
+            if not allow_duplicate:
+                cursor.execute('''
+                    SELECT 1 FROM transactions
+                    WHERE user_id = ? AND fingerprint = ?
+                    AND date BETWEEN date(?, ?) AND date(?, ?)
+                    LIMIT 1
+                ''', (user_id, fingerprint, date, f'-{days} days', date, f'+{days} days'))
+                if cursor.fetchone():
+                    conn.rollback()
+                    print("⚠️ Duplicate transaction skipped")
+                    return None
+            
+            cursor.execute('''
+                INSERT INTO transactions (user_id, category_id, amount, description, transaction_type, date, fingerprint, currency)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, category_id, amount, description, transaction_type, date, fingerprint, currency))
+            transaction_id = cursor.lastrowid
+            self._bump_data_version(conn, user_id)
+            
+            conn.commit()
+            print("✅ Transaction added successfully!")
+            return transaction_id
+        finally:
+            conn.close()
+    
+    def _window_days(self, window_days):
+        """Duplicate window to use, defaulting to duplicate_window_days"""
+        days = self.duplicate_window_days if window_days is None else int(window_days)
+        if days < 0:
+            # date(d, '--1 days') is NULL, which would silently match nothing
+            raise ValueError("window_days must not be negative")
+        return days
+    
+    def import_transactions(self, user_id, transactions, window_days=None):
+        """Bulk insert transactions, skipping ones that already exist
         
-        conn.commit()
+        Each transaction is a dict with category_id, amount, description,
+        transaction_type, date and optionally currency. All rows are checked against existing
+        transactions in one indexed query; rows within the same import are
+        not compared with each other, since a statement can legitimately
+        list two identical purchases. Returns counts of imported and
+        duplicate rows.
+        """
+        days = self._window_days(window_days)
+        base_currency = self.get_base_currency(user_id)
+        rows = []
+        for t in transactions:
+            currency = normalize_currency(t['currency']) if t.get('currency') else base_currency
+            rows.append((user_id, t['category_id'], t['amount'], t['description'], t['transaction_type'], t['date'],
+                         transaction_fingerprint(t['amount'], t['description'], t['transaction_type'], currency),
+                         currency))
+        
+        conn = self.get_connection()
+        try:
+            with conn:
+                # Hold the write lock from the duplicate check to the insert
+                conn.execute('BEGIN IMMEDIATE')
+                candidates = json.dumps([[row[6], row[5]] for row in rows])
+                duplicates = {r['key'] for r in conn.execute('''
+                    SELECT DISTINCT c.key
+                    FROM json_each(?) c
+                    JOIN transactions t
+                      ON t.user_id = ?
+                     AND t.fingerprint = json_extract(c.value, '$[0]')
+                     AND t.date BETWEEN date(json_extract(c.value, '$[1]'), ?)
+                                    AND date(json_extract(c.value, '$[1]'), ?)
+                ''', (candidates, user_id, f'-{days} days', f'+{days} days'))}
+                
+                conn.executemany('''
+                    INSERT INTO transactions (user_id, category_id, amount, description, transaction_type, date, fingerprint, currency)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (row for i, row in enumerate(rows) if i not in duplicates))
+                if len(rows) > len(duplicates):
+                    self._bump_data_version(conn, user_id)
+        finally:
+            conn.close()
+        
+        imported = len(rows) - len(duplicates)
+        print(f"✅ Imported {imported} transaction(s), skipped {len(duplicates)} duplicate(s)")
+        return {'imported': imported, 'duplicates': len(duplicates)}
+    
+    def update_transactions(self, user_id, changes, ids=None, description_contains=None):
+        """Update fields on many transactions with one UPDATE statement
+        
+        Rows are selected by a list of ids and/or a case-insensitive
+        description substring. Returns the number of rows changed.
+        """
+        changes = self._clean_changes(changes)
+        where, params = self._transaction_filter(user_id, ids, description_contains)
+        columns = [field for field in EDITABLE_TRANSACTION_FIELDS if field in changes]
+        assignments = ', '.join(f'{column} = ?' for column in columns)
+        
+        # Keep the duplicate-detection fingerprint in step with the new values
+        fingerprint_fields = ('amount', 'description', 'transaction_type', 'currency')
+        fingerprint_args = ', '.join('?' if field in changes else field for field in fingerprint_fields)
+        assignments += f', fingerprint = txn_fingerprint({fingerprint_args})'
+        values = [changes[column] for column in columns]
+        values += [changes[field] for field in fingerprint_fields if field in changes]
+        
+        conn = self.get_connection()
+        try:
+            with conn:
+                if 'category_id' in changes:
+                    self._check_category_owner(conn, user_id, changes['category_id'])
+                cursor = conn.execute(f'UPDATE transactions SET {assignments} WHERE {where}',
+                                      values + params)
+                updated = cursor.rowcount
+                if updated:
+                    self._bump_data_version(conn, user_id)
+        finally:
+            conn.close()
+        
+        print(f"✅ {updated} transaction(s) updated")
+        return updated
+    
+    @staticmethod
+    def _clean_changes(changes):
+        """Validate batch update values, raising ValueError for anything the
+        table constraints or fingerprint would reject"""
+        unknown = set(changes) - set(EDITABLE_TRANSACTION_FIELDS)
+        if not changes or unknown:
+            raise ValueError(f"changes may only contain: {', '.join(EDITABLE_TRANSACTION_FIELDS)}")
+        
+        cleaned = dict(changes)
+        try:
+            if 'category_id' in cleaned:
+                cleaned['category_id'] = int(cleaned['category_id'])
+            if 'amount' in cleaned:
+                cleaned['amount'] = float(cleaned['amount'])
+                if not math.isfinite(cleaned['amount']):
+                    raise ValueError
+            if 'date' in cleaned:
+                cleaned['date'] = datetime.strptime(cleaned['date'], '%Y-%m-%d').date().isoformat()
+        except (TypeError, ValueError):
+            raise ValueError("category_id must be an integer, amount a number and date YYYY-MM-DD") from None
+        
+        if 'transaction_type' in cleaned and cleaned['transaction_type'] not in ('income', 'expense'):
+            raise ValueError("transaction_type must be 'income' or 'expense'")
+        if 'description' in cleaned and not isinstance(cleaned['description'], str):
+            raise ValueError("description must be text")
+        if 'currency' in cleaned:
+            cleaned['currency'] = normalize_currency(cleaned['currency'])
+        return cleaned
+    
+    def recategorize_transactions(self, user_id, category_id, ids=None, description_contains=None):
+        """Move many transactions to another category"""
+        return self.update_transactions(user_id, {'category_id': category_id},
+                                        ids=ids, description_contains=description_contains)
+    
+    def delete_transactions(self, user_id, ids=None, description_contains=None):
+        """Delete many transactions with one DELETE statement"""
+        where, params = self._transaction_filter(user_id, ids, description_contains)
+        
+        conn = self.get_connection()
+        try:
+            with conn:
+                deleted = conn.execute(f'DELETE FROM transactions WHERE {where}', params).rowcount
+                if deleted:
+                    self._bump_data_version(conn, user_id)
+        finally:
+            conn.close()
+        
+        print(f"✅ {deleted} transaction(s) deleted")
+        return deleted
+    
+    @staticmethod
+    def _transaction_filter(user_id, ids=None, description_contains=None):
+        """Build the WHERE clause selecting a user's transactions for a batch operation"""
+        if ids is None and not description_contains:
+            raise ValueError("either ids or description_contains is required")
+        if ids is not None and not isinstance(ids, (list, tuple)):
+            raise ValueError("ids must be a list")
+        if description_contains is not None and not isinstance(description_contains, str):
+            raise ValueError("description_contains must be text")
+        
+        clauses = ['user_id = ?']
+        params = [user_id]
+        
+        if ids is not None:
+            # Pass the whole id list as one JSON parameter so any number of
+            # ids fits in a single statement without hitting SQLite's variable limit
+            clauses.append('id IN (SELECT value FROM json_each(?))')
+            params.append(json.dumps([int(i) for i in ids]))
+        
+        if description_contains:
+            escaped = description_contains.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            clauses.append("description LIKE ? ESCAPE '\\'")
+            params.append(f'%{escaped}%')
+        
+        return ' AND '.join(clauses), params
+    
+    @staticmethod
+    def _check_category_owner(conn, user_id, category_id):
+        """Raise ValueError unless the category belongs to the user"""
+        row = conn.execute('SELECT 1 FROM categories WHERE id = ? AND user_id = ?',
+                           (category_id, user_id)).fetchone()
+        if row is None:
+            raise ValueError("category not found")
+    
+    def get_base_currency(self, user_id, use_snapshot=False):
+        """Get the currency the user's totals are reported in"""
+        conn = self.get_connection(use_snapshot)
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT base_currency FROM users WHERE id = ?', (user_id,))
+        row = cursor.fetchone()
         conn.close()
-        print("✅ Transaction added successfully!")
+        
+        return row['base_currency'] if row else DEFAULT_CURRENCY
     
-    def get_transactions(self, user_id, limit=None):
-        """Get user's transactions with category names"""
+    def set_base_currency(self, user_id, currency):
+        """Change the currency the user's totals are reported in"""
+        currency = normalize_currency(currency)
         conn = self.get_connection()
+        try:
+            with conn:
+                conn.execute('UPDATE users SET base_currency = ? WHERE id = ?', (currency, user_id))
+                self._bump_data_version(conn, user_id)
+        finally:
+            conn.close()
+        return currency
+    
+    def load_exchange_rates(self, path, reference_currency=DEFAULT_CURRENCY):
+        """Load daily exchange rates from a CSV file into exchange_rates
+        
+        The file has date,currency,rate columns where rate is the value of one
+        unit of currency in reference_currency (which gets a rate of 1 on
+        every date). The file is only re-read when it has changed since the
+        last load. Rates that actually changed bump every user's data
+        version, since their converted totals move with them. Returns the
+        number of rates loaded, or None if unchanged.
+        """
+        source = (os.path.abspath(path), os.path.getmtime(path))
+        if source == self._rates_source:
+            return None
+        
+        reference_currency = normalize_currency(reference_currency)
+        with open(path, newline='') as rates_file:
+            rates = {}
+            for row in csv.DictReader(rates_file):
+                rate_date = datetime.strptime(row['date'].strip(), '%Y-%m-%d').date().isoformat()
+                rates[(normalize_currency(row['currency']), rate_date)] = float(row['rate'])
+                rates[(reference_currency, rate_date)] = 1.0
+        
+        conn = self.get_connection()
+        try:
+            with conn:
+                before = conn.total_changes
+                conn.executemany('''
+                    INSERT INTO exchange_rates (currency, rate_date, rate)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT (currency, rate_date) DO UPDATE SET rate = excluded.rate
+                    WHERE rate != excluded.rate
+                ''', ((currency, rate_date, rate) for (currency, rate_date), rate in rates.items()))
+                if conn.total_changes > before:
+                    # Converted totals may have changed for every user
+                    conn.execute('UPDATE users SET data_version = data_version + 1')
+        finally:
+            conn.close()
+        
+        self._rates_source = source
+        print(f"✅ Loaded {len(rates)} exchange rates")
+        return len(rates)
+    
+    @staticmethod
+    def _bump_data_version(conn, user_id):
+        """Mark the user's data as changed (call inside the write's transaction)"""
+        conn.execute('UPDATE users SET data_version = data_version + 1 WHERE id = ?', (user_id,))
+    
+    def get_data_version(self, user_id, use_snapshot=False):
+        """Get the counter that changes whenever the user's transactions change"""
+        conn = self.get_connection(use_snapshot)
         cursor = conn.cursor()
         
-        query = '''
-            SELECT t.*, c.name as category_name, c.color as category_color
-            FROM transactions t
-            JOIN categories c ON t.category_id = c.id
+        cursor.execute('SELECT data_version FROM users WHERE id = ?', (user_id,))
+        row = cursor.fetchone()
+        conn.close()
+        
+        return row['data_version'] if row else 0
+    
+    def get_transactions(self, user_id, limit=None, use_snapshot=False):
+        """Get user's transactions with category names"""
+        conn = self.get_connection(use_snapshot)
+        cursor = conn.cursor()
+        cursor.row_factory = Transaction.row_factory
+        
+        query = TRANSACTION_SELECT + '''
             WHERE t.user_id = ?
             ORDER BY t.date DESC
         '''
@@ -179,32 +718,50 @@ class FinanceDB:
         transactions = cursor.fetchall()
         conn.close()
         
-        return [dict(row) for row in transactions]
+        return transactions
+    
+    def get_transaction(self, user_id, transaction_id):
+        """Get a single transaction with its category name, or None"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.row_factory = Transaction.row_factory
+        
+        cursor.execute(TRANSACTION_SELECT + '''
+            WHERE t.user_id = ? AND t.id = ?
+        ''', (user_id, transaction_id))
+        
+        transaction = cursor.fetchone()
+        conn.close()
+        
+        return transaction
     
     def get_categories(self, user_id):
         """Get user's categories"""
         conn = self.get_connection()
         cursor = conn.cursor()
+        cursor.row_factory = Category.row_factory
         
         cursor.execute('''
-            SELECT * FROM categories WHERE user_id = ?
+            SELECT id, name, color, user_id FROM categories WHERE user_id = ?
             ORDER BY name
         ''', (user_id,))
         
         categories = cursor.fetchall()
         conn.close()
         
-        return [dict(row) for row in categories]
+        return categories
     
-    def get_spending_by_category(self, user_id, start_date=None, end_date=None):
+    def get_spending_by_category(self, user_id, start_date=None, end_date=None, use_snapshot=False):
         """Get spending breakdown by category"""
-        conn = self.get_connection()
+        conn = self.get_connection(use_snapshot)
         cursor = conn.cursor()
+        cursor.row_factory = CategorySpending.row_factory
         
-        query = '''
-            SELECT c.name, c.color, SUM(t.amount) as total_amount
+        query = f'''
+            SELECT c.name, c.color, SUM({CONVERTED_AMOUNT}) as total_amount
             FROM transactions t
             JOIN categories c ON t.category_id = c.id
+            JOIN users u ON u.id = t.user_id
             WHERE t.user_id = ? AND t.transaction_type = 'expense'
         '''
         params = [user_id]
@@ -217,44 +774,110 @@ class FinanceDB:
             query += ' AND t.date <= ?'
             params.append(end_date)
         
-        query += ' GROUP BY c.id, c.name, c.color ORDER BY total_amount DESC'
+        # Categories holding only amounts without an exchange rate have no total
+        query += ' GROUP BY c.id, c.name, c.color HAVING total_amount IS NOT NULL ORDER BY total_amount DESC'
         
         cursor.execute(query, params)
         spending = cursor.fetchall()
         conn.close()
         
-        return [dict(row) for row in spending]
+        return spending
     
-    def get_monthly_summary(self, user_id, year, month):
-        """Get monthly income vs expenses summary"""
-        conn = self.get_connection()
+    def get_monthly_summary(self, user_id, year, month, use_snapshot=False):
+        """Get monthly income vs expenses summary
+        
+        'unconverted' counts the month's transactions left out of the totals
+        because there is no exchange rate for their currency.
+        """
+        conn = self.get_connection(use_snapshot)
         cursor = conn.cursor()
         
         # Get total income and expenses for the month
-        cursor.execute('''
+        cursor.execute(f'''
             SELECT 
-                transaction_type,
-                SUM(amount) as total
-            FROM transactions
-            WHERE user_id = ? 
-            AND strftime('%Y', date) = ? 
-            AND strftime('%m', date) = ?
-            GROUP BY transaction_type
+                t.transaction_type,
+                SUM({CONVERTED_AMOUNT}) as total,
+                COUNT(*) - COUNT({CONVERTED_AMOUNT}) as unconverted
+            FROM transactions t
+            JOIN users u ON u.id = t.user_id
+            WHERE t.user_id = ? 
+            AND strftime('%Y', t.date) = ? 
+            AND strftime('%m', t.date) = ?
+            GROUP BY t.transaction_type
         ''', (user_id, str(year), f"{month:02d}"))
         
         results = cursor.fetchall()
         conn.close()
         
         summary = {'income': 0, 'expenses': 0}
+        unconverted = 0
         for row in results:
             if row['transaction_type'] == 'income':
-                summary['income'] = float(row['total'])
+                summary['income'] = float(row['total'] or 0)
             else:
-                summary['expenses'] = float(row['total'])
+                summary['expenses'] = float(row['total'] or 0)
+            unconverted += row['unconverted']
         
         summary['balance'] = summary['income'] - summary['expenses']
+        summary['unconverted'] = unconverted
         return summary
 
+    def get_category_series(self, user_id, category_id, granularity, start_date, end_date,
+                            transaction_type='expense', use_snapshot=False):
+        """Get a zero-filled time series of one category's totals
+        
+        granularity is 'day', 'week' or 'month'; start_date and end_date are
+        inclusive date objects. Week buckets start on Monday, month buckets on
+        the 1st. Returns a SeriesPoint per bucket, oldest first.
+        """
+        if granularity not in SERIES_BUCKETS:
+            raise ValueError(f"granularity must be one of: {', '.join(SERIES_BUCKETS)}")
+        if transaction_type not in ('income', 'expense'):
+            raise ValueError("type must be 'income' or 'expense'")
+        if start_date > end_date:
+            raise ValueError("start date must not be after end date")
+        
+        periods = self._series_periods(granularity, start_date, end_date)
+        if len(periods) > MAX_SERIES_POINTS:
+            raise ValueError(f"date range too large for {granularity} granularity")
+        
+        conn = self.get_connection(use_snapshot)
+        cursor = conn.cursor()
+        
+        bucket = SERIES_BUCKETS[granularity]
+        cursor.execute(f'''
+            SELECT {bucket} as period, SUM({CONVERTED_AMOUNT}) as total_amount
+            FROM transactions t
+            JOIN users u ON u.id = t.user_id
+            WHERE t.user_id = ? AND t.category_id = ? AND t.transaction_type = ?
+            AND t.date >= ? AND t.date <= ?
+            GROUP BY period
+        ''', (user_id, category_id, transaction_type, start_date.isoformat(), end_date.isoformat()))
+        
+        totals = {row['period']: row['total_amount'] for row in cursor.fetchall()}
+        conn.close()
+        
+        return [SeriesPoint(period, float(totals.get(period) or 0)) for period in periods]
+    
+    @staticmethod
+    def _series_periods(granularity, start_date, end_date):
+        """List the bucket start dates (as strings) covering a date range"""
+        if granularity == 'day':
+            current, step = start_date, timedelta(days=1)
+        elif granularity == 'week':
+            current, step = start_date - timedelta(days=start_date.weekday()), timedelta(days=7)
+        else:
+            current = start_date.replace(day=1)
+        
+        periods = []
+        while current <= end_date and len(periods) <= MAX_SERIES_POINTS:
+            periods.append(current.isoformat())
+            if granularity == 'month':
+                current = date(current.year + current.month // 12, current.month % 12 + 1, 1)
+            else:
+                current += step
+        return periods
+
 # Test the database setup
 if __name__ == '__main__':
     # Initialize database
@@ -0,0 +1,110 @@
+"""
+Server-sent events for live dashboard updates.
+
+Each open dashboard subscribes to its user's stream; writes publish small
+deltas (new transaction, month totals, category slices) that the page
+applies without reloading. The broker lives in process memory, so events
+only reach clients connected to the same server process.
+
+Every open stream holds a server thread, so the number of streams is capped
+(max_streams) and each stream ends after stream_seconds. The browser then
+reconnects with the id of the last event it saw, and the caller decides
+whether it missed anything and needs the current state (initial).
+"""
+
+import json
+import queue
+import threading
+import time
+from collections import defaultdict
+
+
+def format_sse(event, data, event_id=None):
+    """Format one server-sent event message"""
+    message = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    if event_id is not None:
+        message = f"id: {event_id}\n" + message
+    return message
+
+
+class EventBroker:
+    """Fan out events to every open stream of a user"""
+
+    def __init__(self, max_queue_size=100, heartbeat_seconds=15, max_streams=None, stream_seconds=None):
+        self.max_queue_size = max_queue_size
+        self.heartbeat_seconds = heartbeat_seconds
+        self.max_streams = max_streams  # None = unlimited
+        self.stream_seconds = stream_seconds  # None = streams never end on their own
+        self._subscribers = defaultdict(set)
+        self._stream_count = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        """Register a new stream for the user and return its queue, or None
+        if max_streams are already open"""
+        subscriber = queue.Queue(maxsize=self.max_queue_size)
+        with self._lock:
+            if self.max_streams is not None and self._stream_count >= self.max_streams:
+                return None
+            self._subscribers[user_id].add(subscriber)
+            self._stream_count += 1
+        return subscriber
+
+    def unsubscribe(self, user_id, subscriber):
+        """Remove a stream (called when the client disconnects)"""
+        with self._lock:
+            streams = self._subscribers.get(user_id)
+            if streams is not None and subscriber in streams:
+                streams.remove(subscriber)
+                self._stream_count -= 1
+                if not streams:
+                    del self._subscribers[user_id]
+
+    def has_subscribers(self, user_id):
+        """True if the user has at least one open stream"""
+        with self._lock:
+            return bool(self._subscribers.get(user_id))
+
+    def publish(self, user_id, event, data, event_id=None):
+        """Send an event to all of the user's open streams"""
+        message = format_sse(event, data, event_id)
+        with self._lock:
+            streams = list(self._subscribers.get(user_id, ()))
+
+        for subscriber in streams:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # A stalled client shouldn't hold up writes - it misses this
+                # event and catches up when it reconnects
+                pass
+
+    def stream(self, user_id, subscriber, initial=(), initial_id=None):
+        """Generator of SSE messages for one client connection
+
+        subscriber comes from subscribe(); the stream starts with the
+        (event, data) pairs in initial, tagged with initial_id, and
+        unsubscribes when it ends.
+        """
+        try:
+            # Tell the browser how long to wait before reconnecting
+            yield "retry: 5000\n\n"
+            for event, data in initial:
+                yield format_sse(event, data, initial_id)
+
+            deadline = None if self.stream_seconds is None else time.monotonic() + self.stream_seconds
+            while True:
+                timeout = self.heartbeat_seconds
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        # Free the thread; the browser reconnects after the retry delay
+                        return
+                    timeout = min(timeout, remaining)
+                try:
+                    yield subscriber.get(timeout=timeout)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(user_id, subscriber)
@@ -0,0 +1,61 @@
+"""
+Render cache for template fragments.
+
+Fragments are keyed by name, user and the user's data version (bumped by
+FinanceDB on every write), so a cached fragment is reused until that user's
+data changes. Old versions are never read again and simply age out of the
+least-recently-used list.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class FragmentCache:
+    """Bounded LRU cache of rendered fragments with hit-rate stats"""
+
+    def __init__(self, max_entries=500):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_render(self, key, render):
+        """Return the cached fragment for key, calling render() on a miss"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        # Render outside the lock so a slow query doesn't block other users
+        fragment = render()
+
+        with self._lock:
+            self._entries[key] = fragment
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return fragment
+
+    def clear(self):
+        """Drop all cached fragments (stats are kept)"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Cache size and hit-rate counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
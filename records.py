@@ -0,0 +1,109 @@
+"""
+Lightweight row types returned by FinanceDB.
+
+Each record is a plain __slots__ class built straight from the SQLite tuple,
+so a read allocates one small object per row instead of a sqlite3.Row plus
+a dict copy. Records still support row['column'] access so existing code
+and templates keep working.
+"""
+
+
+class Record:
+    """Base class for all FinanceDB row types"""
+    __slots__ = ()
+
+    # Records compare by value but are mutable, so they are deliberately unhashable
+    __hash__ = None
+
+    @classmethod
+    def row_factory(cls, cursor, row):
+        """sqlite3 row factory - SELECT columns must follow __slots__ order"""
+        return cls(*row)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.astuple() == other.astuple()
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'{type(self).__name__}({fields})'
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return self.__slots__
+
+    def astuple(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def asdict(self):
+        """Convert to a dictionary (used for JSON responses)"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Transaction(Record):
+    """A transaction joined with its category name and color
+
+    base_amount is the amount in the user's base currency, or None if there
+    is no exchange rate for it.
+    """
+    __slots__ = ('id', 'user_id', 'category_id', 'amount', 'description',
+                 'transaction_type', 'date', 'currency', 'created_at',
+                 'category_name', 'category_color', 'base_amount')
+
+    def __init__(self, id, user_id, category_id, amount, description,
+                 transaction_type, date, currency, created_at,
+                 category_name, category_color, base_amount):
+        self.id = id
+        self.user_id = user_id
+        self.category_id = category_id
+        self.amount = amount
+        self.description = description
+        self.transaction_type = transaction_type
+        self.date = date
+        self.currency = currency
+        self.created_at = created_at
+        self.category_name = category_name
+        self.category_color = category_color
+        self.base_amount = base_amount
+
+
+class Category(Record):
+    """A spending category"""
+    __slots__ = ('id', 'name', 'color', 'user_id')
+
+    def __init__(self, id, name, color, user_id):
+        self.id = id
+        self.name = name
+        self.color = color
+        self.user_id = user_id
+
+
+class CategorySpending(Record):
+    """Total spending for one category"""
+    __slots__ = ('name', 'color', 'total_amount')
+
+    def __init__(self, name, color, total_amount):
+        self.name = name
+        self.color = color
+        self.total_amount = total_amount
+
+
+class SeriesPoint(Record):
+    """Total amount for one time bucket of a category series"""
+    __slots__ = ('period', 'total_amount')
+
+    def __init__(self, period, total_amount):
+        self.period = period
+        self.total_amount = total_amount
@@ -5,8 +5,44 @@ Test script to verify Personal Finance Tracker setup
 
 import os
 import sys
+import tempfile
+from contextlib import contextmanager
 from datetime import datetime
 
+@contextmanager
+def temp_db(**options):
+    """Throwaway database with one user, yields (db, user_id) and deletes it afterwards"""
+    from database import FinanceDB
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = FinanceDB(os.path.join(tmp_dir, 'test.db'), **options)
+        try:
+            user_id = db.create_user("recorduser", "records@example.com", "password123")
+            yield db, user_id
+        finally:
+            db.stop_snapshot_refresher()
+
+@contextmanager
+def temp_client():
+    """Flask test client logged in as a fresh user on a throwaway database,
+    yields (client, db, user_id)"""
+    import app as app_module
+    
+    with temp_db() as (db, user_id):
+        saved_db = app_module.db
+        app_module.db = db
+        app_module.fragments.clear()
+        app_module.app.testing = True
+        try:
+            with app_module.app.test_client() as client:
+                with client.session_transaction() as session:
+                    session['user_id'] = user_id
+                    session['username'] = 'recorduser'
+                yield client, db, user_id
+        finally:
+            app_module.db = saved_db
+            app_module.fragments.clear()
+
 def test_imports():
     """Test if all required modules can be imported"""
     print("🧪 Testing imports...")
@@ -57,6 +93,539 @@ def test_database():
         print(f"❌ Database error: {e}")
         return False
 
+def test_records():
+    """Test that reads return lightweight records"""
+    print("\n📦 Testing record types...")
+    from records import Transaction, Category, CategorySpending
+    
+    with temp_db() as (db, user_id):
+        categories = db.get_categories(user_id)
+        assert all(isinstance(c, Category) for c in categories)
+        food = next(c for c in categories if c.name == 'Food & Dining')
+        
+        db.add_transaction(user_id, food.id, 25.5, 'Lunch', 'expense', '2024-03-05')
+        transactions = db.get_transactions(user_id)
+        assert isinstance(transactions[0], Transaction)
+        assert transactions[0]['category_name'] == 'Food & Dining'
+        assert transactions[0].amount == 25.5
+        assert not hasattr(transactions[0], '__dict__')
+        assert dict(transactions[0])['description'] == 'Lunch'
+        try:
+            hash(transactions[0])
+            assert False, "records should be unhashable"
+        except TypeError:
+            pass
+        print("✅ Transactions and categories are records")
+        
+        spending = db.get_spending_by_category(user_id)
+        assert spending == [CategorySpending('Food & Dining', food.color, 25.5)]
+        assert spending[0].asdict() == {'name': 'Food & Dining', 'color': food.color, 'total_amount': 25.5}
+        print("✅ Category spending is a record")
+    
+    return True
+
+def test_category_series():
+    """Test zero-filled category series at each granularity"""
+    print("\n📈 Testing category series...")
+    from datetime import date
+    
+    with temp_db() as (db, user_id):
+        food = next(c for c in db.get_categories(user_id) if c.name == 'Food & Dining')
+        db.add_transaction(user_id, food.id, 10, 'Coffee', 'expense', '2024-01-30')
+        db.add_transaction(user_id, food.id, 5, 'Snack', 'expense', '2024-02-01')
+        db.add_transaction(user_id, food.id, 20, 'Dinner', 'expense', '2024-02-01')
+        
+        days = db.get_category_series(user_id, food.id, 'day', date(2024, 1, 30), date(2024, 2, 2))
+        assert [(p.period, p.total_amount) for p in days] == [
+            ('2024-01-30', 10.0), ('2024-01-31', 0.0), ('2024-02-01', 25.0), ('2024-02-02', 0.0)]
+        
+        weeks = db.get_category_series(user_id, food.id, 'week', date(2024, 1, 24), date(2024, 2, 10))
+        assert [(p.period, p.total_amount) for p in weeks] == [
+            ('2024-01-22', 0.0), ('2024-01-29', 35.0), ('2024-02-05', 0.0)]
+        
+        months = db.get_category_series(user_id, food.id, 'month', date(2023, 12, 15), date(2024, 3, 1))
+        assert [(p.period, p.total_amount) for p in months] == [
+            ('2023-12-01', 0.0), ('2024-01-01', 10.0), ('2024-02-01', 25.0), ('2024-03-01', 0.0)]
+        print("✅ Day, week and month series are zero-filled")
+        
+        try:
+            db.get_category_series(user_id, food.id, 'year', date(2024, 1, 1), date(2024, 2, 1))
+            assert False, "invalid granularity accepted"
+        except ValueError:
+            print("✅ Invalid granularity rejected")
+    
+    return True
+
+def test_category_series_route():
+    """Test the /api/category_series endpoint"""
+    print("\n📈 Testing category series API...")
+    with temp_client() as (client, db, user_id):
+        food = next(c for c in db.get_categories(user_id) if c.name == 'Food & Dining')
+        db.add_transaction(user_id, food.id, 10, 'Coffee', 'expense', '2024-01-30')
+        
+        response = client.get(f'/api/category_series?category_id={food.id}&granularity=month'
+                              '&start=2024-01-01&end=2024-02-29')
+        assert response.status_code == 200
+        assert response.get_json() == [{'period': '2024-01-01', 'total_amount': 10.0},
+                                       {'period': '2024-02-01', 'total_amount': 0.0}]
+        print("✅ Series returned as JSON")
+        
+        income = next(c for c in db.get_categories(user_id) if c.name == 'Income')
+        db.add_transaction(user_id, income.id, 2000, 'Salary', 'income', '2024-02-01')
+        response = client.get(f'/api/category_series?category_id={income.id}&type=income'
+                              '&start=2024-02-01&end=2024-02-29')
+        assert response.get_json() == [{'period': '2024-02-01', 'total_amount': 2000.0}]
+        print("✅ Income categories charted with type=income")
+        
+        for query in ('granularity=month', f'category_id={food.id}&granularity=year',
+                      f'category_id={food.id}&start=2024-13-01', f'category_id={food.id}&type=transfer'):
+            assert client.get(f'/api/category_series?{query}').status_code == 400
+        print("✅ Bad parameters rejected")
+    
+    return True
+
+def test_batch_operations():
+    """Test batch edit, recategorize and delete"""
+    print("\n🧹 Testing batch operations...")
+    with temp_db() as (db, user_id):
+        categories = {c.name: c.id for c in db.get_categories(user_id)}
+        other_user = db.create_user("batchother", "batchother@example.com", "password123")
+        
+        for i in range(5):
+            db.add_transaction(user_id, categories['Other'], 10 + i, f'UBER trip {i}', 'expense', '2024-05-01')
+        db.add_transaction(user_id, categories['Other'], 99, 'Rent_100%', 'expense', '2024-05-01')
+        db.add_transaction(other_user, db.get_categories(other_user)[0].id, 5, 'Uber trip', 'expense', '2024-05-01')
+        
+        moved = db.recategorize_transactions(user_id, categories['Transportation'], description_contains='uber')
+        assert moved == 5
+        assert len(db.get_transactions(other_user)) == 1
+        assert db.update_transactions(user_id, {'amount': 1}, description_contains='_100%') == 1
+        assert db.update_transactions(user_id, {'amount': 1}, description_contains='0%') == 1
+        print("✅ Recategorize and update by description filter")
+        
+        ids = [t.id for t in db.get_transactions(user_id) if t.category_name == 'Transportation']
+        assert db.update_transactions(user_id, {'description': 'Uber'}, ids=ids[:2]) == 2
+        assert db.delete_transactions(user_id, ids=ids) == 5
+        assert db.delete_transactions(user_id, ids=[t.id for t in db.get_transactions(other_user)]) == 0
+        assert [t.description for t in db.get_transactions(user_id)] == ['Rent_100%']
+        print("✅ Update and delete by ids")
+        
+        for bad_call in (lambda: db.delete_transactions(user_id),
+                         lambda: db.update_transactions(user_id, {'user_id': other_user}, ids=ids),
+                         lambda: db.recategorize_transactions(user_id, db.get_categories(other_user)[0].id, ids=ids)):
+            try:
+                bad_call()
+                assert False, "invalid batch operation accepted"
+            except ValueError:
+                pass
+        print("✅ Invalid batch operations rejected")
+    
+    return True
+
+def test_batch_routes():
+    """Test the batch update, recategorize and delete endpoints"""
+    print("\n🧹 Testing batch operation routes...")
+    with temp_client() as (client, db, user_id):
+        categories = {c.name: c.id for c in db.get_categories(user_id)}
+        ids = [db.add_transaction(user_id, categories['Other'], 10 + i, f'Taxi {i}', 'expense', '2024-05-01')
+               for i in range(3)]
+        
+        for changes in ({'transaction_type': 'transfer'}, {'amount': 'abc'}, {'amount': 'nan'}, {'date': '2024-02-30'},
+                        {'category_id': 'x'}, {'description': 5}, {'currency': 'dollars'}, {'id': 1}):
+            response = client.post('/update_transactions', json={'ids': ids, 'changes': changes})
+            assert response.status_code == 400, changes
+        assert sorted(t.amount for t in db.get_transactions(user_id)) == [10, 11, 12]
+        print("✅ Invalid changes rejected with 400")
+        
+        response = client.post('/update_transactions', json={'ids': ids[:2], 'changes': {'amount': '7.5'}})
+        assert response.status_code == 200 and response.get_json()['updated'] == 2
+        assert db.get_transaction(user_id, ids[0]).amount == 7.5
+        
+        response = client.post('/recategorize_transactions',
+                               json={'description_contains': 'taxi', 'category_id': categories['Transportation']})
+        assert response.status_code == 200 and response.get_json()['updated'] == 3
+        assert client.post('/recategorize_transactions', json={'ids': ids}).status_code == 400
+        
+        for selector in ({}, {'ids': str(ids[0])}, {'description_contains': 5}):
+            assert client.post('/delete_transactions', json=selector).status_code == 400, selector
+        response = client.post('/delete_transactions', json={'ids': ids[:1]})
+        assert response.status_code == 200 and response.get_json()['deleted'] == 1
+        assert len(db.get_transactions(user_id)) == 2
+        print("✅ Batch routes update, move and delete")
+        
+        with client.session_transaction() as session:
+            session.clear()
+        for route in ('/update_transactions', '/recategorize_transactions', '/delete_transactions'):
+            assert client.post(route, json={'ids': ids}).status_code == 401
+        print("✅ Batch routes require login")
+    
+    return True
+
+def test_duplicate_detection():
+    """Test fingerprint-based duplicate detection on add and import"""
+    print("\n🔁 Testing duplicate detection...")
+    with temp_db() as (db, user_id):
+        other = next(c.id for c in db.get_categories(user_id) if c.name == 'Other')
+        
+        assert db.add_transaction(user_id, other, 42.0, 'ACME Store #12', 'expense', '2024-06-10')
+        assert db.add_transaction(user_id, other, 42, ' acme  store 12 ', 'expense', '2024-06-10') is None
+        assert db.add_transaction(user_id, other, 42, 'ACME Store #12', 'income', '2024-06-10')
+        assert db.add_transaction(user_id, other, 42, 'ACME Store #12', 'expense', '2024-06-12')
+        assert db.add_transaction(user_id, other, 42, 'ACME Store #12', 'expense', '2024-06-13', window_days=1) is None
+        assert db.add_transaction(user_id, other, 42, 'ACME Store #12', 'expense', '2024-06-10', allow_duplicate=True)
+        print("✅ Duplicate single adds are skipped")
+        
+        # Simultaneous double-submits: only one of them may insert
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            added = list(pool.map(lambda _: db.add_transaction(user_id, other, 3, 'Double click', 'expense',
+                                                               '2024-06-20'), range(8)))
+        assert sum(1 for transaction_id in added if transaction_id) == 1
+        print("✅ Concurrent duplicates inserted once")
+        
+        rows = [
+            {'category_id': other, 'amount': 42, 'description': 'acme store 12', 'transaction_type': 'expense', 'date': '2024-06-11'},
+            {'category_id': other, 'amount': 7, 'description': 'Bakery', 'transaction_type': 'expense', 'date': '2024-06-11'},
+            {'category_id': other, 'amount': 7, 'description': 'Bakery', 'transaction_type': 'expense', 'date': '2024-06-11'},
+        ]
+        assert db.import_transactions(user_id, rows) == {'imported': 3, 'duplicates': 0}
+        assert db.import_transactions(user_id, rows) == {'imported': 0, 'duplicates': 3}
+        assert db.import_transactions(user_id, rows[1:2], window_days=3) == {'imported': 0, 'duplicates': 1}
+        print("✅ Duplicate imports are skipped")
+        
+        bakery = [t.id for t in db.get_transactions(user_id) if t.description == 'Bakery']
+        db.update_transactions(user_id, {'description': 'Corner Bakery'}, ids=bakery)
+        assert db.add_transaction(user_id, other, 7, 'corner bakery', 'expense', '2024-06-11') is None
+        print("✅ Fingerprints follow batch edits")
+        
+        try:
+            db.import_transactions(user_id, [], window_days=-1)
+            assert False, "negative duplicate window accepted"
+        except ValueError:
+            pass
+        print("✅ Negative duplicate window rejected")
+    
+    return True
+
+def test_import_csv_route():
+    """Test the /import_csv endpoint"""
+    import io
+    
+    print("\n📥 Testing CSV import API...")
+    with temp_client() as (client, db, user_id):
+        def upload(text, **form):
+            return client.post('/import_csv', data={'file': (io.BytesIO(text.encode()), 'import.csv'), **form},
+                               content_type='multipart/form-data')
+        
+        header = 'Date,Description,Category,Type,Amount\n'
+        response = upload(header + '2024-03-01,Coffee,Food & Dining,Expense,$4.50\n'
+                                   '2024-03-02,Mystery,No Such Category,Expense,"1,000.00"\n')
+        assert response.status_code == 200 and response.get_json()['imported'] == 2
+        assert {t.category_name for t in db.get_transactions(user_id)} == {'Food & Dining', 'Other'}
+        assert upload(header + '2024-03-01,Coffee,Food & Dining,Expense,4.50\n').get_json()['duplicates'] == 1
+        print("✅ Rows imported, unknown categories filed under Other, duplicates skipped")
+        
+        response = upload(header + '2024-03-03,Tea,Food & Dining,Expense,3\n'
+                                   '2024-03-03,Savings,Other,Transfer,50\n')
+        assert response.status_code == 400 and 'line 3' in response.get_json()['message']
+        assert upload(header + '2024-03-03,Tea,Food & Dining,Expense,3\n', window_days='-1').status_code == 400
+        assert upload('Date,Amount\n2024-03-03,3\n').status_code == 400
+        assert upload(header + '2024-03-03,Tea,Food & Dining,Expense,inf\n').status_code == 400
+        assert upload(header.replace('Amount', 'Amount,Currency') +
+                      '2024-03-03,Tea,Food & Dining,Expense,3,EUR\n'
+                      '2024-03-03,Tea,Food & Dining,Expense,3,Euro\n').status_code == 400
+        assert len(db.get_transactions(user_id)) == 2
+        
+        conn = db.get_connection()
+        conn.execute("DELETE FROM categories WHERE user_id = ? AND name = 'Other'", (user_id,))
+        conn.commit()
+        conn.close()
+        response = upload(header + '2024-03-03,Mystery,No Such Category,Expense,3\n')
+        assert response.status_code == 400 and 'line 2' in response.get_json()['message']
+        print("✅ Bad rows rejected with their line number")
+    
+    return True
+
+def test_event_broker():
+    """Test server-sent event fan-out per user"""
+    print("\n📡 Testing event broker...")
+    from events import EventBroker
+    
+    broker = EventBroker(heartbeat_seconds=0.01)
+    stream = broker.stream(1, broker.subscribe(1))
+    assert next(stream).startswith('retry:')
+    assert broker.has_subscribers(1) and not broker.has_subscribers(2)
+    
+    broker.publish(2, 'summary', {'income': 1})
+    broker.publish(1, 'summary', {'income': 5.0, 'expenses': 2.0})
+    assert next(stream) == 'event: summary\ndata: {"income": 5.0, "expenses": 2.0}\n\n'
+    assert next(stream) == ': keepalive\n\n'
+    broker.publish(1, 'summary', {}, event_id=7)
+    assert next(stream) == 'id: 7\nevent: summary\ndata: {}\n\n'
+    print("✅ Events reach only the user's streams")
+    
+    stream.close()
+    assert not broker.has_subscribers(1)
+    print("✅ Closed streams unsubscribe")
+    
+    broker = EventBroker(heartbeat_seconds=0.01, max_streams=1, stream_seconds=0.05)
+    subscriber = broker.subscribe(1)
+    assert broker.subscribe(2) is None
+    stream = broker.stream(1, subscriber, initial=[('summary', {'income': 1})])
+    assert list(stream)[:2] == ['retry: 5000\n\n', 'event: summary\ndata: {"income": 1}\n\n']
+    assert broker.subscribe(2) is not None
+    print("✅ Streams are capped, start with the current state and end after stream_seconds")
+    
+    return True
+
+def test_events_route():
+    """Test the /events endpoint"""
+    import app as app_module
+    
+    print("\n📡 Testing live events API...")
+    with temp_client() as (client, db, user_id):
+        food = next(c for c in db.get_categories(user_id) if c.name == 'Food & Dining')
+        db.add_transaction(user_id, food.id, 12, 'Lunch', 'expense', datetime.now().strftime('%Y-%m-%d'))
+        
+        version = db.get_data_version(user_id)
+        
+        response = client.get('/events?last_event_id=0')
+        assert response.status_code == 200 and response.mimetype == 'text/event-stream'
+        chunks = response.response
+        assert next(chunks) == b'retry: 5000\n\n'
+        assert next(chunks).startswith(f'id: {version}\nevent: summary\ndata: {{"income": 0, "expenses": 12.0'.encode())
+        assert next(chunks).startswith(b'id: %d\nevent: categories\n' % version)
+        assert b'"description": "Lunch"' in next(chunks)
+        print("✅ Stream behind the current data version starts with the dashboard state")
+        
+        current = client.get('/events', headers={'Last-Event-ID': str(version)})
+        current_chunks = current.response
+        assert next(current_chunks) == b'retry: 5000\n\n'
+        added = client.post('/add_transaction', json={'category_id': food.id, 'amount': 3, 'description': 'Tea',
+                                                      'transaction_type': 'expense', 'date': '2024-01-05'})
+        updates = added.get_json()['updates']
+        assert [name for name, _ in updates] == ['summary', 'transaction', 'category']
+        assert updates[1][1]['description'] == 'Tea'
+        # Nothing was resent on connect, so the next message is the new transaction's update
+        assert next(current_chunks).startswith(b'id: %d\nevent: summary\n' % (version + 1))
+        current.close()
+        print("✅ Up-to-date stream skips the state; adds return their updates")
+        
+        saved_limit = app_module.broker.max_streams
+        app_module.broker.max_streams = 0
+        try:
+            assert client.get('/events').status_code == 503
+        finally:
+            app_module.broker.max_streams = saved_limit
+        response.close()
+        assert not app_module.broker.has_subscribers(user_id)
+        print("✅ Streams over the limit refused, closed streams free their slot")
+        
+        with client.session_transaction() as session:
+            session.clear()
+        assert client.get('/events').status_code == 401
+    
+    return True
+
+def test_fragment_cache():
+    """Test fragment cache hits, eviction and data versions"""
+    print("\n🗃️ Testing fragment cache...")
+    from fragment_cache import FragmentCache
+    
+    cache = FragmentCache(max_entries=2)
+    renders = []
+    render = lambda name: (lambda: renders.append(name) or f'<p>{name}</p>')
+    
+    assert cache.get_or_render(('a', 1, 0), render('a')) == '<p>a</p>'
+    assert cache.get_or_render(('a', 1, 0), render('a-again')) == '<p>a</p>'
+    cache.get_or_render(('b', 1, 0), render('b'))
+    cache.get_or_render(('c', 1, 0), render('c'))
+    cache.get_or_render(('a', 1, 0), render('a'))
+    assert renders == ['a', 'b', 'c', 'a']
+    assert cache.stats() == {'entries': 2, 'max_entries': 2, 'hits': 1, 'misses': 4,
+                             'evictions': 2, 'hit_rate': 0.2}
+    print("✅ LRU eviction and hit-rate stats")
+    
+    import app as app_module
+    client = app_module.app.test_client()
+    saved_token = app_module.STATS_TOKEN
+    app_module.STATS_TOKEN = None
+    try:
+        assert client.get('/api/cache_stats', headers={'X-Stats-Token': ''}).status_code == 404
+        app_module.STATS_TOKEN = 'operator-secret'
+        assert client.get('/api/cache_stats', headers={'X-Stats-Token': 'guess'}).status_code == 404
+        response = client.get('/api/cache_stats', headers={'X-Stats-Token': 'operator-secret'})
+        assert response.status_code == 200 and 'hit_rate' in response.get_json()
+    finally:
+        app_module.STATS_TOKEN = saved_token
+    print("✅ Cache stats only served to operators with the token")
+    
+    with temp_db() as (db, user_id):
+        other = next(c.id for c in db.get_categories(user_id) if c.name == 'Other')
+        version = db.get_data_version(user_id)
+        db.add_transaction(user_id, other, 3, 'Gum', 'expense', '2024-07-01')
+        db.add_transaction(user_id, other, 3, 'Gum', 'expense', '2024-07-01')  # duplicate, not a write
+        assert db.get_data_version(user_id) == version + 1
+        db.delete_transactions(user_id, description_contains='no such row')
+        assert db.get_data_version(user_id) == version + 1
+        db.delete_transactions(user_id, description_contains='gum')
+        assert db.get_data_version(user_id) == version + 2
+        print("✅ Data version changes only on writes")
+    
+    return True
+
+def test_currency_conversion():
+    """Test in-SQL conversion to the user's base currency"""
+    print("\n💱 Testing currency conversion...")
+    from datetime import date
+    
+    with temp_db() as (db, user_id):
+        other = next(c.id for c in db.get_categories(user_id) if c.name == 'Other')
+        rates_path = os.path.join(os.path.dirname(db.db_path), 'rates.csv')
+        with open(rates_path, 'w') as rates_file:
+            rates_file.write("date,currency,rate\n2024-08-01,EUR,1.10\n2024-08-02,EUR,1.20\n2024-08-02,GBP,1.25\n")
+        assert db.load_exchange_rates(rates_path) == 5
+        assert db.load_exchange_rates(rates_path) is None
+        
+        db.add_transaction(user_id, other, 100, 'Salary', 'income', '2024-08-01')
+        db.add_transaction(user_id, other, 10, 'Paris cafe', 'expense', '2024-08-01', currency='eur')
+        db.add_transaction(user_id, other, 10, 'Paris museum', 'expense', '2024-08-04', currency='EUR')
+        db.add_transaction(user_id, other, 5, 'Tokyo snack', 'expense', '2024-08-04', currency='JPY')
+        assert db.get_transactions(user_id, limit=1)[0].currency in ('EUR', 'JPY')
+        
+        summary = db.get_monthly_summary(user_id, 2024, 8)
+        assert round(summary['expenses'], 2) == 11.0 + 12.0  # weekend uses Friday's rate
+        assert summary['unconverted'] == 1  # no JPY rate - left out, not counted as 5 USD
+        assert summary['income'] == 100
+        series = db.get_category_series(user_id, other, 'day', date(2024, 8, 1), date(2024, 8, 1))
+        assert round(series[0].total_amount, 2) == 11.0
+        print("✅ Foreign amounts converted with the latest rate")
+        
+        db.set_base_currency(user_id, 'GBP')
+        spending = db.get_spending_by_category(user_id, '2024-08-02', '2024-08-31')
+        assert round(spending[0].total_amount, 2) == round(10 * 1.20 / 1.25, 2)
+        assert {t.description: t.base_amount for t in db.get_transactions(user_id)}['Tokyo snack'] is None
+        print("✅ Totals follow the base currency")
+        
+        try:
+            db.add_transaction(user_id, other, 1, 'Bad', 'expense', '2024-08-01', currency='EURO')
+            assert False, "invalid currency accepted"
+        except ValueError:
+            print("✅ Invalid currency rejected")
+        
+        assert db.add_transaction(user_id, other, 10, 'Paris cafe', 'expense', '2024-08-01', currency='GBP')
+        assert db.add_transaction(user_id, other, 10, 'Paris cafe', 'expense', '2024-08-01', currency='EUR') is None
+        assert db.import_transactions(user_id, [{'category_id': other, 'amount': 100, 'description': 'Salary',
+                                                 'transaction_type': 'income', 'date': '2024-08-01'}]) == \
+            {'imported': 1, 'duplicates': 0}  # base currency is GBP now, the existing salary is USD
+        print("✅ Duplicate detection tells currencies apart")
+        
+        # Databases with fingerprints from before currencies are backfilled once
+        conn = db.get_connection()
+        conn.execute("UPDATE transactions SET fingerprint = 'stale'")
+        conn.execute('PRAGMA user_version = 1')
+        conn.commit()
+        conn.close()
+        db.init_database()
+        assert db.add_transaction(user_id, other, 10, 'Paris museum', 'expense', '2024-08-04', currency='EUR') is None
+        print("✅ Old fingerprints recomputed")
+    
+    return True
+
+def test_currency_routes():
+    """Test /set_base_currency and currency-aware formatting"""
+    print("\n💱 Testing currency API...")
+    import app as app_module
+    
+    assert app_module.format_money(1234.5) == '$1234.50'
+    assert app_module.format_money(-2, 'EUR') == '-2.00 EUR'
+    
+    with temp_client() as (client, db, user_id):
+        other = next(c.id for c in db.get_categories(user_id) if c.name == 'Other')
+        db.add_transaction(user_id, other, 12, 'Lunch', 'expense', datetime.now().strftime('%Y-%m-%d'))
+        assert b'$12.00' in client.get('/dashboard').data
+        
+        assert client.post('/set_base_currency', json={'currency': 'euro'}).status_code == 400
+        response = client.post('/set_base_currency', json={'currency': 'eur'})
+        assert response.status_code == 200 and response.get_json()['currency'] == 'EUR'
+        assert db.get_base_currency(user_id) == 'EUR'
+        
+        page = client.get('/dashboard').data
+        # No USD->EUR rate: the lunch is left out of the EUR totals and flagged
+        assert b'0.00 EUR' in page and b'$12.00' in page and b'id="unconvertedCount">1<' in page
+        print("✅ Base currency changed and used for totals")
+        
+        with client.session_transaction() as session:
+            session.clear()
+        assert client.post('/set_base_currency', json={'currency': 'GBP'}).status_code == 401
+    
+    return True
+
+def test_snapshot_reads():
+    """Test report reads from the read-only snapshot"""
+    print("\n📸 Testing analytics snapshot...")
+    import sqlite3
+    import time
+    from database import FinanceDB
+    
+    with temp_db(snapshot_max_age=3600) as (db, user_id):
+        other = next(c.id for c in db.get_categories(user_id) if c.name == 'Other')
+        
+        db.add_transaction(user_id, other, 10, 'First', 'expense', '2024-09-01')
+        assert db.refresh_snapshot() is True
+        assert db.refresh_snapshot() is False
+        print("✅ Unchanged data is not copied again")
+        
+        snapshot_inode = os.stat(db.snapshot_path).st_ino
+        db.add_transaction(user_id, other, 5, 'Second', 'expense', '2024-09-02')
+        assert db.get_monthly_summary(user_id, 2024, 9, use_snapshot=True)['expenses'] == 10
+        assert db.get_monthly_summary(user_id, 2024, 9)['expenses'] == 15
+        assert len(db.get_transactions(user_id, use_snapshot=True)) == 1
+        assert os.stat(db.snapshot_path).st_ino == snapshot_inode
+        print("✅ Snapshot reads never refresh the snapshot themselves")
+        
+        # A second handle on the same database with a 1 second max age
+        fast = FinanceDB(db.db_path, snapshot_max_age=1)
+        try:
+            db.add_transaction(user_id, other, 1, 'Third', 'expense', '2024-09-03')
+            deadline = time.time() + 5
+            while (db.get_monthly_summary(user_id, 2024, 9, use_snapshot=True)['expenses'] != 16
+                   and time.time() < deadline):
+                time.sleep(0.05)
+        finally:
+            fast.stop_snapshot_refresher()
+        assert db.get_monthly_summary(user_id, 2024, 9, use_snapshot=True)['expenses'] == 16
+        print("✅ Background thread refreshes a stale snapshot")
+        
+        try:
+            db.get_connection(use_snapshot=True).execute('DELETE FROM transactions')
+            assert False, "snapshot accepted a write"
+        except sqlite3.OperationalError:
+            print("✅ Snapshot is read-only")
+        
+        db.add_transaction(user_id, other, 4, 'Fourth', 'expense', '2024-09-04')
+        assert db.get_monthly_summary(user_id, 2024, 9, use_snapshot=True)['expenses'] == 16
+        os.utime(db.snapshot_path, (0, 0))  # as if refreshes had been failing
+        assert db.get_monthly_summary(user_id, 2024, 9, use_snapshot=True)['expenses'] == 20
+        print("✅ A snapshot past twice its max age falls back to live reads")
+        
+        live_only = FinanceDB(db.db_path)
+        assert live_only.get_monthly_summary(user_id, 2024, 9, use_snapshot=True)['expenses'] == 20
+        
+        rates_path = os.path.join(os.path.dirname(db.db_path), 'rates.csv')
+        with open(rates_path, 'w') as rates_file:
+            rates_file.write('date,currency,rate\n2024-09-01,EUR,1.10\n')
+        version = db.get_data_version(user_id)
+        assert db.load_exchange_rates(rates_path) == 2
+        assert db.get_data_version(user_id) == version + 1
+        # Reloading a rewritten file with the same rates changes nothing
+        os.utime(rates_path, (0, 0))
+        assert db.load_exchange_rates(rates_path) == 2
+        assert db.get_data_version(user_id) == version + 1
+        print("✅ Changed exchange rates bump the data version")
+    
+    return True
+
 def test_file_structure():
     """Test if all required files exist"""
     print("\n📁 Testing file structure...")
@@ -129,6 +698,19 @@ def main():
         ("File Structure", test_file_structure),
         ("Python Imports", test_imports),
         ("Database Operations", test_database),
+        ("Record Types", test_records),
+        ("Category Series", test_category_series),
+        ("Category Series API", test_category_series_route),
+        ("Batch Operations", test_batch_operations),
+        ("Batch Operation API", test_batch_routes),
+        ("Duplicate Detection", test_duplicate_detection),
+        ("CSV Import API", test_import_csv_route),
+        ("Event Broker", test_event_broker),
+        ("Live Events API", test_events_route),
+        ("Fragment Cache", test_fragment_cache),
+        ("Currency Conversion", test_currency_conversion),
+        ("Currency API", test_currency_routes),
+        ("Analytics Snapshot", test_snapshot_reads),
         ("Flask Routes", test_app_routes)
     ]
     